@@ -1,12 +1,20 @@
 # app.py
 import os
-import json
-from datetime import datetime, timedelta
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-import requests
+import httpx
+import orjson
 import streamlit as st
 import pandas as pd
 
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
 # =============================
 # Page Config
 # =============================
@@ -23,7 +31,7 @@ with st.sidebar:
     weather_key_input = st.text_input("OpenWeatherMap API Key", type="password")
     use_env = st.checkbox("Secrets / 환경변수 사용", value=True)
 
-def get_key(name, sidebar_value):
+def get_key(name, sidebar_value, use_env):
     if sidebar_value:
         return sidebar_value
     if use_env:
@@ -32,57 +40,144 @@ def get_key(name, sidebar_value):
         return os.getenv(name)
     return None
 
-OPENAI_API_KEY = get_key("OPENAI_API_KEY", openai_key_input)
-OPENWEATHER_API_KEY = get_key("OPENWEATHER_API_KEY", weather_key_input)
+def _resolved_keys(sidebar_openai, sidebar_weather, use_env):
+    # 사이드바 입력이 그대로면 이 세션에서는 secrets / 환경변수를 다시 조회하지 않음
+    inputs = (sidebar_openai, sidebar_weather, use_env)
+    cached = st.session_state.get("resolved_keys")
+    if cached and cached[0] == inputs:
+        return cached[1]
+    keys = (
+        get_key("OPENAI_API_KEY", sidebar_openai, use_env),
+        get_key("OPENWEATHER_API_KEY", sidebar_weather, use_env),
+    )
+    st.session_state.resolved_keys = (inputs, keys)
+    return keys
+
+OPENAI_API_KEY, OPENWEATHER_API_KEY = _resolved_keys(
+    openai_key_input, weather_key_input, use_env
+)
 
 # =============================
 # External APIs
 # =============================
+STREAM_FLUSH_TOKENS = 8
+STREAM_FLUSH_SECONDS = 0.05
+# 서버의 모든 세션이 공유하는 prefetch 스레드 수. 세션당 최대 2개(날씨 / 강아지)라
+# 동시 접속 8명까지는 대기 없이 처리되고, 그 이상이면 클릭 시 직접 요청으로 대체됨
+PREFETCH_WORKERS = 16
+REPORT_CACHE_SIZE = 20
+
+@st.cache_resource
+def _http():
+    # 날씨 / 강아지 API 연결을 rerun 사이에서도 유지
+    transport = httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=8),
+        retries=1,
+    )
+    return httpx.Client(transport=transport, timeout=10.0)
+
+@st.cache_resource(max_entries=8, ttl=3600)
+def _openai_client(api_key):
+    # 키별로 클라이언트를 한 번만 만들어 커넥션 풀을 재사용
+    return OpenAI(api_key=api_key, timeout=60, max_retries=1)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _fetch_weather(city, api_key):
+    # 실패 시 예외를 던져서 실패 결과는 캐시되지 않도록 함
+    r = _http().get(
+        "https://api.openweathermap.org/data/2.5/weather",
+        params={
+            "q": city,
+            "appid": api_key,
+            "units": "metric",
+            "lang": "kr",
+        },
+    )
+    r.raise_for_status()
+    d = orjson.loads(r.content)
+    return {
+        "city": city,
+        "temp": d["main"]["temp"],
+        "desc": d["weather"][0]["description"],
+    }
+
 def get_weather(city, api_key):
     if not api_key:
         return None
     try:
-        r = requests.get(
-            "https://api.openweathermap.org/data/2.5/weather",
-            params={
-                "q": city,
-                "appid": api_key,
-                "units": "metric",
-                "lang": "kr",
-            },
-            timeout=10,
-        )
-        if r.status_code != 200:
-            return None
-        d = r.json()
-        return {
-            "city": city,
-            "temp": d["main"]["temp"],
-            "desc": d["weather"][0]["description"],
-        }
-    except Exception:
+        return _fetch_weather(city, api_key)
+    except (httpx.HTTPError, KeyError, IndexError, TypeError, ValueError):
         return None
 
 def get_dog_image():
     try:
-        r = requests.get("https://dog.ceo/api/breeds/image/random", timeout=10)
+        r = _http().get("https://dog.ceo/api/breeds/image/random")
         if r.status_code != 200:
             return None
-        data = r.json()
+        data = orjson.loads(r.content)
         url = data.get("message")
         breed = "알 수 없음"
         if "/breeds/" in url:
             breed = url.split("/breeds/")[1].split("/")[0].replace("-", " ")
         return {"url": url, "breed": breed}
+    except (httpx.HTTPError, AttributeError, TypeError, ValueError):
+        return None
+
+@st.cache_resource
+def _executor():
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+
+def _dog_today(day):
+    if st.session_state.get("dog_date") == day.isoformat():
+        return st.session_state.get("dog_today")
+    return None
+
+def prefetch_external(city, weather_key, day):
+    # 도시가 정해지면 버튼을 누르기 전에 날씨 / 강아지 요청을 미리 시작
+    pool = _executor()
+    if st.session_state.get("prefetch_key") != (city, weather_key):
+        st.session_state.prefetch_key = (city, weather_key)
+        st.session_state.weather_future = pool.submit(get_weather, city, weather_key)
+    # 오늘 받은 강아지가 있으면 다시 요청하지 않음
+    if _dog_today(day) is None and st.session_state.get("dog_future") is None:
+        st.session_state.dog_future = pool.submit(get_dog_image)
+
+def _result(future):
+    # 끝난 prefetch만 사용. 아직 큐에서 기다리거나 실행 중이면 기다리지 않고
+    # None을 돌려줘서 호출 쪽이 직접 요청하도록 함
+    if future is None:
+        return None
+    if not future.done():
+        future.cancel()
+        return None
+    try:
+        return future.result()
     except Exception:
         return None
 
-def generate_report(habits, mood, weather, dog, style, api_key):
-    if not api_key:
+def collect_external(city, weather_key, day):
+    # prefetch는 날씨 캐시를 데우는 용도이고, 값은 TTL 캐시에서 다시 읽어
+    # 오래 전에 받아둔 날씨가 그대로 쓰이지 않도록 함 (끝나지 않았으면 직접 요청)
+    _result(st.session_state.pop("weather_future", None))
+    weather = get_weather(city, weather_key)
+    st.session_state.prefetch_key = None
+
+    dog = _dog_today(day)
+    if dog is None:
+        dog = _result(st.session_state.pop("dog_future", None))
+        if dog is None:
+            dog = get_dog_image()
+        if dog:
+            st.session_state.dog_today = dog
+            st.session_state.dog_date = day.isoformat()
+    return weather, dog
+
+def generate_report(done, not_done, mood, weather, dog, style, api_key, placeholder):
+    if not api_key or OpenAI is None:
         return None
 
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
+    client = _openai_client(api_key)
 
     system_prompts = {
         "스파르타 코치": "너는 엄격하고 직설적인 스파르타 코치다.",
@@ -92,15 +187,15 @@ def generate_report(habits, mood, weather, dog, style, api_key):
 
     payload = {
         "기분": mood,
-        "완료습관": [k for k, v in habits.items() if v],
-        "미완료습관": [k for k, v in habits.items() if not v],
+        "완료습관": done,
+        "미완료습관": not_done,
         "날씨": weather,
         "강아지품종": dog["breed"] if dog else None,
     }
 
     user_prompt = (
         "다음 데이터를 기반으로 컨디션 리포트를 작성해줘.\n\n"
-        + json.dumps(payload, ensure_ascii=False, indent=2)
+        + orjson.dumps(payload).decode()
         + "\n\n출력 형식:\n"
           "1) 컨디션 등급(S~D)\n"
           "2) 습관 분석\n"
@@ -109,98 +204,166 @@ def generate_report(habits, mood, weather, dog, style, api_key):
           "5) 오늘의 한마디"
     )
 
+    # 토큰을 받는 대로 표시하되, 매 토큰마다 다시 그리지 않도록 묶어서 갱신
+    buf = []
+    pending = 0
+    last_flush = time.monotonic()
     try:
-        res = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model="gpt-5-mini",
             messages=[
                 {"role": "system", "content": system_prompts[style]},
                 {"role": "user", "content": user_prompt},
             ],
+            stream=True,
         )
-        return res.choices[0].message.content
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if not delta:
+                continue
+            buf.append(delta)
+            pending += 1
+            now = time.monotonic()
+            if pending >= STREAM_FLUSH_TOKENS or now - last_flush >= STREAM_FLUSH_SECONDS:
+                placeholder.markdown("".join(buf))
+                pending = 0
+                last_flush = now
     except Exception:
+        placeholder.empty()
         return None
 
+    report = "".join(buf)
+    if not report:
+        placeholder.empty()
+        return None
+    placeholder.markdown(report)
+    return report
+
+def quick_report(weather):
+    # 완료한 습관도 없고 기분도 기본값이면 모델을 부르지 않고 고정 리포트 사용
+    w = f"{weather['desc']} · {weather['temp']}℃" if weather else "날씨 정보 없음"
+    return (
+        "1) 컨디션 등급: D\n\n"
+        "2) 습관 분석: 아직 완료한 습관이 없어요.\n\n"
+        f"3) 날씨 코멘트: {w}\n\n"
+        f"4) 내일 미션: {' · '.join(HABIT_NAMES[:3])}\n\n"
+        "5) 오늘의 한마디: 작은 습관 하나부터 시작해봐요!"
+    )
+
+def report_key(done, mood, weather, dog, style, day, api_key):
+    # 같은 날 같은 입력이면 같은 리포트 (API 키는 해시로만 보관)
+    return (
+        tuple(done),
+        mood,
+        (weather["city"], weather["desc"], weather["temp"]) if weather else None,
+        dog["breed"] if dog else None,
+        style,
+        day.isoformat(),
+        hashlib.sha256(api_key.encode()).hexdigest()[:16] if api_key else None,
+    )
+
+def remember_report(key, report):
+    # 다른 날짜 항목은 버리고, 오늘 항목도 오래된 것부터 REPORT_CACHE_SIZE개까지만 유지
+    cache = st.session_state.report_cache
+    for k in [k for k in cache if k[5] != key[5]]:
+        del cache[k]
+    cache[key] = report
+    while len(cache) > REPORT_CACHE_SIZE:
+        del cache[next(iter(cache))]
+
 # =============================
 # Session State
 # =============================
 if "history" not in st.session_state:
     st.session_state.history = []
 
+if "report_cache" not in st.session_state:
+    st.session_state.report_cache = {}
+
 # =============================
 # Habit UI
 # =============================
-habits_def = {
-    "⏰ 기상 미션": False,
-    "💧 물 마시기": False,
-    "📚 공부/독서": False,
-    "🏃 운동하기": False,
-    "🛌 수면": False,
-}
+HABITS = (
+    ("⏰", "기상 미션"),
+    ("💧", "물 마시기"),
+    ("📚", "공부/독서"),
+    ("🏃", "운동하기"),
+    ("🛌", "수면"),
+)
+HABIT_NAMES = tuple(n for _, n in HABITS)
+HABIT_LABELS = tuple(f"{e} {n}" for e, n in HABITS)
+DEFAULT_MOOD = 6
 
 st.subheader("✅ 오늘의 습관")
-c1, c2 = st.columns(2)
 
-habits = {}
-for i, (k, _) in enumerate(habits_def.items()):
-    with (c1 if i % 2 == 0 else c2):
-        habits[k] = st.checkbox(k)
+# 폼으로 묶어서 위젯을 바꿀 때마다가 아니라 제출할 때만 rerun
+# 리포트 생성도 폼 제출 버튼이라 항상 방금 입력한 값으로 생성됨
+with st.form("checkin", clear_on_submit=False):
+    c1, c2 = st.columns(2)
 
-mood = st.slider("😊 오늘 기분", 1, 10, 6)
+    habits = {}
+    for i, (label, name) in enumerate(zip(HABIT_LABELS, HABIT_NAMES)):
+        with (c1 if i % 2 == 0 else c2):
+            habits[name] = st.checkbox(label, key=f"h_{i}")
 
-city = st.selectbox(
-    "🌍 도시",
-    ["Seoul", "Busan", "Incheon", "Daegu", "Daejeon", "Gwangju", "Ulsan", "Suwon", "Jeju", "Sejong"],
-)
+    mood = st.slider("😊 오늘 기분", 1, 10, DEFAULT_MOOD)
 
-style = st.radio(
-    "🎭 코치 스타일",
-    ["스파르타 코치", "따뜻한 멘토", "게임 마스터"],
-)
+    city = st.selectbox(
+        "🌍 도시",
+        ["Seoul", "Busan", "Incheon", "Daegu", "Daejeon", "Gwangju", "Ulsan", "Suwon", "Jeju", "Sejong"],
+    )
+
+    style = st.radio(
+        "🎭 코치 스타일",
+        ["스파르타 코치", "따뜻한 멘토", "게임 마스터"],
+    )
+
+    b1, b2 = st.columns(2)
+    b1.form_submit_button("확인", use_container_width=True)
+    generate = b2.form_submit_button(
+        "🧠 컨디션 리포트 생성", type="primary", use_container_width=True
+    )
 
 # =============================
 # Metrics
 # =============================
-checked = sum(habits.values())
+done, not_done = [], []
+for k, v in habits.items():
+    (done if v else not_done).append(k)
+
+checked = len(done)
 rate = int(checked / len(habits) * 100)
 
 m1, m2, m3 = st.columns(3)
 m1.metric("달성률", f"{rate}%")
-m2.metric("완료 습관", f"{checked}/5")
+m2.metric("완료 습관", f"{checked}/{len(HABITS)}")
 m3.metric("기분", f"{mood}/10")
 
 # =============================
 # Chart
 # =============================
-today = datetime.now().date()
-data = []
-
-for i in range(6, 0, -1):
-    data.append(
-        {"date": today - timedelta(days=i), "rate": [50, 60, 40, 70, 80, 55][6 - i]}
-    )
-
-data.append({"date": today, "rate": rate})
+@st.cache_data
+def demo_frame(today):
+    # 지난 6일 데모 데이터는 날짜가 바뀔 때만 다시 생성
+    dates = pd.date_range(end=today, periods=7, name="date")[:-1]
+    return pd.DataFrame({"rate": [50, 60, 40, 70, 80, 55]}, index=dates)
 
-df = pd.DataFrame(data).set_index("date")
-st.bar_chart(df)
+today = datetime.now().date()
+df = pd.concat(
+    [demo_frame(today), pd.DataFrame({"rate": [rate]}, index=pd.DatetimeIndex([today], name="date"))]
+)
+# 7개 점뿐이라 낮은 높이의 스파크라인으로 표시
+st.line_chart(df, height=120)
 
 # =============================
 # Generate Report
 # =============================
 st.divider()
-if st.button("🧠 컨디션 리포트 생성", type="primary"):
-    weather = get_weather(city, OPENWEATHER_API_KEY)
-    dog = get_dog_image()
-
-    report = generate_report(
-        habits=habits,
-        mood=mood,
-        weather=weather,
-        dog=dog,
-        style=style,
-        api_key=OPENAI_API_KEY,
-    )
+prefetch_external(city, OPENWEATHER_API_KEY, today)
+if generate:
+    weather, dog = collect_external(city, OPENWEATHER_API_KEY, today)
 
     c1, c2 = st.columns(2)
 
@@ -220,9 +383,28 @@ if st.button("🧠 컨디션 리포트 생성", type="primary"):
             st.warning("강아지 이미지 없음")
 
     st.subheader("📋 AI 리포트")
-    if report:
+    if OPENAI_API_KEY and not done and mood == DEFAULT_MOOD:
+        report = quick_report(weather)
         st.markdown(report)
     else:
+        key = report_key(done, mood, weather, dog, style, today, OPENAI_API_KEY)
+        report = st.session_state.report_cache.get(key)
+        if report:
+            st.markdown(report)
+        else:
+            report = generate_report(
+                done=done,
+                not_done=not_done,
+                mood=mood,
+                weather=weather,
+                dog=dog,
+                style=style,
+                api_key=OPENAI_API_KEY,
+                placeholder=st.empty(),
+            )
+            if report:
+                remember_report(key, report)
+    if not report:
         st.error("리포트 생성 실패 (API Key 확인)")
 
 # =============================